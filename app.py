@@ -1,19 +1,31 @@
 import os
-import json
+import asyncio
 import logging
-from fastapi import FastAPI, HTTPException
+import queue
+from pathlib import Path
+from logging.handlers import QueueHandler, QueueListener
+from fastapi import FastAPI
 from prometheus_client import Gauge, generate_latest, CONTENT_TYPE_LATEST
 from starlette.responses import Response
 import httpx
+import orjson
 
+# Records are handed to a background thread so log writes never block the
+# event loop
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(
+    log_queue,
+    logging.FileHandler('/var/log/speedtest-bridge.log'),
+    logging.StreamHandler()
+)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('/var/log/speedtest-bridge.log'),
-        logging.StreamHandler()
-    ]
+    handlers=[QueueHandler(log_queue)]
 )
+log_listener.start()
+# httpx logs every request at INFO, i.e. one line per poll
+logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
@@ -25,102 +37,168 @@ packet_loss_gauge = Gauge("internet_packet_loss_percent", "Packet loss percentag
 ping_jitter_gauge = Gauge("internet_ping_jitter_ms", "Ping jitter in milliseconds")
 ping_low_gauge = Gauge("internet_ping_low_ms", "Lowest ping in milliseconds")
 ping_high_gauge = Gauge("internet_ping_high_ms", "Highest ping in milliseconds")
+last_success_gauge = Gauge(
+    "internet_speedtest_last_success_timestamp_seconds",
+    "Unix time of the last successful poll of the SpeedTest Tracker API"
+)
+
+# (gauge setter, key) pairs for fields at the top level of response['data'].
+# Bound methods are looked up once here rather than on every update.
+TOP_FIELDS = (
+    (ping_gauge.set, 'ping'),
+    (download_gauge.set, 'download_bits'),
+    (upload_gauge.set, 'upload_bits'),
+)
+# (gauge setter, key) pairs for fields under response['data']['data']['ping']
+PING_FIELDS = (
+    (ping_jitter_gauge.set, 'jitter'),
+    (ping_low_gauge.set, 'low'),
+    (ping_high_gauge.set, 'high'),
+)
+_set_packet_loss = packet_loss_gauge.set
+
+# Exposition text, re-rendered after each poll so scrapes serve it as-is.
+# None until the first success, so no placeholder zeros are exported.
+_rendered = None
+
+# Seconds between polls of the SpeedTest Tracker API. Clamped so a zero or
+# negative value cannot turn the poller into a busy loop or give the client
+# pool a non-positive keepalive expiry.
+POLL_INTERVAL_S = max(1, int(os.getenv("POLL_INTERVAL", 30)))
+
+CONFIG_PATH = Path(__file__).with_name('config.json')
 
 def load_config():
-    config_path = os.path.join(os.path.dirname(__file__), 'config.json')
     try:
-        with open(config_path, 'r') as f:
-            config = json.load(f)
+        config = orjson.loads(CONFIG_PATH.read_bytes())
         required_keys = ['api_host', 'bearer_token']
         for key in required_keys:
             if key not in config:
                 raise ValueError(f"Missing required config key: {key}")
         return config
     except FileNotFoundError:
-        logger.error(f"Config file not found at {config_path}")
-        raise HTTPException(status_code=500, detail="Configuration file not found")
-    except json.JSONDecodeError as e:
-        logger.error(f"Invalid JSON in config file: {e}")
-        raise HTTPException(status_code=500, detail="Invalid configuration file")
+        logger.error("Config file not found at %s", CONFIG_PATH)
+        raise
+    except orjson.JSONDecodeError as e:
+        logger.error("Invalid JSON in config file: %s", e)
+        raise
     except Exception as e:
-        logger.error(f"Error loading config: {e}")
-        raise HTTPException(status_code=500, detail="Configuration error")
+        logger.error("Error loading config: %s", e)
+        raise
 
-async def fetch_latest_speedtest():
-    config = load_config()
-    url = f"{config['api_host'].rstrip('/')}/api/v1/results/latest"
-    headers = {
+@app.on_event("startup")
+async def startup():
+    config = app.state.config = load_config()
+    app.state.speedtest_url = config['api_host'].rstrip('/') + "/api/v1/results/latest"
+    app.state.speedtest_headers = {
         'Accept': 'application/json',
         'Authorization': f"Bearer {config['bearer_token']}"
     }
+    app.state.client = httpx.AsyncClient(
+        headers=app.state.speedtest_headers,
+        # Some proxies misbehave with HTTP/2; set "http2": false in config.json
+        http2=config.get('http2', True),
+        timeout=httpx.Timeout(30.0, connect=5.0),
+        # A single sequential poller only ever needs one connection; keep it
+        # alive across the gap between polls so it is actually reused
+        limits=httpx.Limits(
+            max_keepalive_connections=1,
+            max_connections=1,
+            keepalive_expiry=POLL_INTERVAL_S * 2
+        )
+    )
+    app.state.poll_task = asyncio.create_task(_poll_loop())
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.poll_task.cancel()
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(url, headers=headers)
-            response.raise_for_status()
-            return response.json()
-    except httpx.TimeoutException:
-        logger.error("Timeout while fetching speedtest data")
-        raise HTTPException(status_code=504, detail="API request timed out")
-    except httpx.HTTPStatusError as e:
-        logger.error(f"HTTP error {e.response.status_code} while fetching speedtest data")
-        raise HTTPException(status_code=502, detail=f"API returned {e.response.status_code}")
-    except Exception as e:
-        logger.error(f"Error fetching speedtest data: {e}")
-        raise HTTPException(status_code=502, detail="Error fetching speedtest data")
+        await app.state.poll_task
+    except asyncio.CancelledError:
+        pass
+    await app.state.client.aclose()
+    # Stopped last so anything logged during shutdown is still written
+    log_listener.stop()
+
+async def fetch_latest_speedtest():
+    # Check the status before reading the body so error pages are never downloaded
+    async with app.state.client.stream("GET", app.state.speedtest_url) as response:
+        response.raise_for_status()
+        return orjson.loads(await response.aread())
 
 def update_metrics_from_api_response(response):
-    try:
-        # The API response has a nested structure: response['data'] contains the speedtest data
-        if 'data' not in response:
-            logger.error("No 'data' key found in API response")
-            return
-            
-        data = response['data']
-        
-        # Set basic metrics from the top level of data
-        if 'ping' in data and data['ping'] is not None:
-            ping_gauge.set(float(data['ping']))
-        if 'download_bits' in data and data['download_bits'] is not None:
-            download_gauge.set(float(data['download_bits']))
-        if 'upload_bits' in data and data['upload_bits'] is not None:
-            upload_gauge.set(float(data['upload_bits']))
+    # The API response has a nested structure: response['data'] contains the speedtest data
+    if 'data' not in response:
+        raise ValueError("No 'data' key found in API response")
         
-        # The detailed data is nested under data['data']
-        if 'data' in data and isinstance(data['data'], dict):
-            detailed_data = data['data']
-            
-            # Packet loss might not always be present
-            if 'packetLoss' in detailed_data and detailed_data['packetLoss'] is not None:
-                packet_loss_gauge.set(float(detailed_data['packetLoss']))
-            
-            # Ping details are under data['data']['ping']
-            if 'ping' in detailed_data and isinstance(detailed_data['ping'], dict):
-                ping_data = detailed_data['ping']
-                if 'jitter' in ping_data and ping_data['jitter'] is not None:
-                    ping_jitter_gauge.set(float(ping_data['jitter']))
-                if 'low' in ping_data and ping_data['low'] is not None:
-                    ping_low_gauge.set(float(ping_data['low']))
-                if 'high' in ping_data and ping_data['high'] is not None:
-                    ping_high_gauge.set(float(ping_data['high']))
+    data = response['data']
+    
+    # Set basic metrics from the top level of data
+    for set_gauge, key in TOP_FIELDS:
+        value = data.get(key)
+        if value is not None:
+            set_gauge(value)
+    
+    # The detailed data is nested under data['data']
+    detailed_data = data.get('data')
+    if isinstance(detailed_data, dict):
+        # Packet loss might not always be present
+        value = detailed_data.get('packetLoss')
+        if value is not None:
+            _set_packet_loss(value)
         
-        logger.info("Updated metrics from API response")
-    except (ValueError, TypeError, KeyError) as e:
-        logger.error(f"Error updating metrics: {e}")
-        raise
+        # Ping details are under data['data']['ping']
+        ping_data = detailed_data.get('ping')
+        if isinstance(ping_data, dict):
+            for set_gauge, key in PING_FIELDS:
+                value = ping_data.get(key)
+                if value is not None:
+                    set_gauge(value)
+    
+    logger.debug("Updated metrics from API response")
 
-@app.get("/metrics")
-async def metrics():
-    try:
-        api_data = await fetch_latest_speedtest()
-        update_metrics_from_api_response(api_data)
-        return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Unexpected error in metrics endpoint: {e}")
-        raise HTTPException(status_code=500, detail="Internal server error")
+async def _poll_loop():
+    global _rendered
+    # A failed poll leaves the speedtest gauges at their last values; the
+    # last-success timestamp is what shows how stale they are
+    initialized = False
+    while True:
+        try:
+            api_data = await fetch_latest_speedtest()
+            update_metrics_from_api_response(api_data)
+        except httpx.TimeoutException:
+            logger.error("Timeout while fetching speedtest data")
+        except httpx.HTTPStatusError as e:
+            logger.error("HTTP error %s while fetching speedtest data", e.response.status_code)
+        except Exception:
+            logger.exception("Error polling speedtest data")
+        else:
+            last_success_gauge.set_to_current_time()
+            initialized = True
+        # Re-render after every poll, failed or not, so the process metrics
+        # stay current
+        if initialized:
+            _rendered = generate_latest()
+        await asyncio.sleep(POLL_INTERVAL_S)
+
+# Registered as a plain Starlette route to skip FastAPI's request parsing and
+# dependency handling, which /metrics does not need
+async def metrics(request):
+    if _rendered is None:
+        return Response("No speedtest data fetched yet", status_code=503)
+    return Response(_rendered, media_type=CONTENT_TYPE_LATEST)
+
+app.add_route("/metrics", metrics, methods=["GET"])
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        log_level="warning",
+        access_log=False
+    )